@@ -1,16 +1,34 @@
-import os, shutil
-from datetime import datetime, timedelta
-from typing import List, Optional
-
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Request, Response
+import os, re, shutil, asyncio, time, base64, hashlib, hmac, tempfile, threading, logging
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from anyio import to_thread
+from fastapi import (
+    FastAPI, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response, BackgroundTasks
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 from sqlalchemy import (
-    Column, Integer, String, DateTime, ForeignKey, Boolean, Float, create_engine, Text, or_
+    Column, Integer, String, DateTime, ForeignKey, Boolean, Float, create_engine, Text, or_,
+    event, Index, func, select, insert, update, delete, desc, tuple_, lambda_stmt, inspect
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import (
+    sessionmaker, declarative_base, relationship, Session, selectinload, joinedload, raiseload, load_only
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session
 import json  # ⬅️ NEW
+import orjson
 
 # ----------------- Config / Env -----------------
 DB_URL = os.getenv("DVCR_DB", "sqlite:///./dvcr.db")
@@ -19,17 +37,51 @@ JWT_SECRET = os.getenv("DVCR_JWT_SECRET", "dev-secret-change-me")
 JWT_EXPIRE_MINUTES = int(os.getenv("DVCR_JWT_EXPIRE_MINUTES", "43200"))  # 30 days
 PM_OIL_SOON_MILES = int(os.getenv("DVCR_PM_OIL_SOON_MILES", "5000"))
 PM_CHASSIS_SOON_MILES = int(os.getenv("DVCR_PM_CHASSIS_SOON_MILES", "3000"))
-
-ALLOWED_ORIGINS = [
+OIL_INTERVAL = 20000      # miles between oil services
+CHASSIS_INTERVAL = 10000  # miles between chassis services
+PM_TYPES = ("oil", "chassis")  # service types that drive PM due dates
+BCRYPT_ROUNDS = int(os.getenv("DVCR_BCRYPT_ROUNDS", "12"))  # set 10 in dev for faster logins
+USER_CACHE_TTL = float(os.getenv("DVCR_USER_CACHE_TTL", "30"))  # seconds
+TOKEN_CACHE_MAX = int(os.getenv("DVCR_TOKEN_CACHE_MAX", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("DVCR_TOKEN_CACHE_TTL", "30"))  # seconds, also capped by token exp
+PM_CACHE_MAX = int(os.getenv("DVCR_PM_CACHE_MAX", "4096"))
+PM_CACHE_TTL = float(os.getenv("DVCR_PM_CACHE_TTL", "60"))  # seconds; only bounds memory, entries are versioned
+SEED_DEMO = os.getenv("DVCR_SEED_DEMO", "0") == "1"  # dev only: demo logins with a known password
+# create tables/indexes on startup; set to 0 once the schema is managed elsewhere
+INIT_DB = os.getenv("DVCR_INIT_DB", "1") == "1"
+INIT_LOCK_PATH = os.getenv("DVCR_INIT_LOCK", os.path.join(tempfile.gettempdir(), "dvcr-init.lock"))
+THREADPOOL_SIZE = int(os.getenv("DVCR_THREADPOOL_SIZE", "100"))
+DEBUG_RAISELOAD = os.getenv("DVCR_DEBUG_RAISELOAD") == "1"  # dev/test only, see DEFAULT_LOAD_OPTS
+# dev: log requests that issue more SQL statements than this (0 = off)
+QUERY_WARN = int(os.getenv("DVCR_QUERY_WARN", "0"))
+# set to 0 when a reverse proxy serves UPLOAD_DIR at /uploads (see README)
+SERVE_UPLOADS = os.getenv("DVCR_SERVE_UPLOADS", "1") == "1"
+
+# frozenset: CORSMiddleware checks `origin in allow_origins` on every request
+ALLOWED_ORIGINS = frozenset([
     "http://localhost:3000",
     "http://127.0.0.1:3000",
     "https://resourceful-compassion-production.up.railway.app",
     # add more frontend URLs as needed (e.g. your Railway frontend)
-]
+])
+ALLOWED_ORIGIN_RE = re.compile(r"https://.*\.up\.railway\.app")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # ----------------- App -----------------
-app = FastAPI(title="DVCR API")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # sync (def) endpoints run on AnyIO's threadpool, 40 threads by default;
+    # uploads and PM/report queries shouldn't queue behind each other there
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    if INIT_DB:
+        await asyncio.to_thread(init_db)
+    # seeding hashes passwords; do it once the app is up, off the event loop
+    if SEED_DEMO:
+        await asyncio.to_thread(seed_demo)
+    yield
+
+# orjson encodes the nested ReportOut trees (datetimes included) much faster than stdlib json
+app = FastAPI(title="DVCR API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # alias purely for log searches (optional)
 app.add_mmiddleware = app.add_middleware  # type: ignore[attr-defined]
@@ -37,19 +89,93 @@ app.add_mmiddleware = app.add_middleware  # type: ignore[attr-defined]
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
-    allow_origin_regex=r"https://.*\.up\.railway\.app",
+    allow_origin_regex=ALLOWED_ORIGIN_RE,  # type: ignore[arg-type]  # Starlette re.compile()s it: a no-op for a Pattern
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # explicit lists: preflights are answered from a fixed header instead of
+    # echoing whatever the browser asked for
+    allow_methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
+    allow_headers=["authorization", "content-type", "x-user-id"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],  # paging headers read by the frontend
+    max_age=86400,  # browsers may cache a preflight for a day
 )
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+
+# Per-request SQL statement counter for DVCR_QUERY_WARN. The middleware installs
+# a fresh [0]; a list so bumps made in threadpool (copied) contexts are visible.
+_query_count: ContextVar[Optional[List[int]]] = ContextVar("dvcr_query_count", default=None)
+logger = logging.getLogger(__name__)
+
+if QUERY_WARN:
+    @app.middleware("http")
+    async def _warn_query_count(request: Request, call_next):
+        counter = [0]
+        token = _query_count.set(counter)
+        try:
+            return await call_next(request)
+        finally:
+            _query_count.reset(token)
+            if counter[0] > QUERY_WARN:
+                logger.warning(
+                    "Query count warning: %s %s issued %d statements",
+                    request.method, request.url.path, counter[0],
+                )
+
+if SERVE_UPLOADS:
+    app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 # ----------------- DB -----------------
+# Railway/Heroku hand out postgres:// URLs; route them to psycopg (v3)
+for _prefix in ("postgres://", "postgresql://"):
+    if DB_URL.startswith(_prefix):
+        DB_URL = "postgresql+psycopg://" + DB_URL[len(_prefix):]
+
+if DB_URL.startswith("sqlite"):
+    _engine_opts = {"connect_args": {"check_same_thread": False}}
+    # in-memory SQLite gets a single-connection pool that takes no sizing args
+    if DB_URL not in ("sqlite://", "sqlite:///:memory:"):
+        # LIFO hands out the most recently used connection, whose page cache is warm
+        _engine_opts.update(pool_size=10, max_overflow=20, pool_timeout=30, pool_use_lifo=True)
+else:
+    # networked DB: bigger pool, and drop connections the server closed
+    # (restarts, idle timeouts) before handing them to a request; LIFO lets
+    # surplus connections go idle and get recycled instead of all staying warm
+    _engine_opts = {
+        "pool_size": 20, "max_overflow": 40, "pool_timeout": 30,
+        "pool_pre_ping": True, "pool_recycle": 1800, "pool_use_lifo": True,
+    }
+    if os.getenv("DVCR_DB_SSLMODE"):
+        _engine_opts["connect_args"] = {"sslmode": os.getenv("DVCR_DB_SSLMODE")}
+
 engine = create_engine(
     DB_URL,
-    connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {}
+    # room for every distinct statement shape the app builds (default is 500)
+    query_cache_size=1200,
+    **_engine_opts,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+if DB_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # WAL lets readers run alongside a writer; synchronous=NORMAL skips the
+        # per-commit fsync (still durable across app crashes in WAL mode).
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.execute("PRAGMA cache_size=-65536")
+        cur.execute("PRAGMA busy_timeout=5000")
+        cur.close()
+
+if QUERY_WARN:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_statement(*_args):
+        counter = _query_count.get()
+        if counter is not None:
+            counter[0] += 1
+
+# expire_on_commit=False: handlers return the objects they just wrote, and every
+# column value is already set client-side, so re-SELECTing after commit is waste
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
 # ----------------- Models -----------------
@@ -71,8 +197,7 @@ class PMAlert(BaseModel):
     chassis_miles_remaining: int
     oil_due_soon: bool
     chassis_due_soon: bool
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class Truck(Base):
     __tablename__ = "trucks"
@@ -81,15 +206,20 @@ class Truck(Base):
     vin = Column(String, nullable=True)
     active = Column(Boolean, default=True)
     odometer = Column(Integer, default=0)
+    pm_version = Column(Integer, nullable=False, default=0)  # bumped on every service write
     # cascades ensure deleting a truck removes child rows
     reports = relationship("Report", back_populates="truck", cascade="all, delete-orphan")
     services = relationship("ServiceRecord", back_populates="truck", cascade="all, delete-orphan")
 
 class Report(Base):
     __tablename__ = "reports"
+    # list_reports: WHERE truck_id = ? ORDER BY created_at DESC walks this index in order
+    __table_args__ = (
+        Index("ix_reports_truck_created", "truck_id", desc("created_at")),
+    )
     id = Column(Integer, primary_key=True)
     truck_id = Column(Integer, ForeignKey("trucks.id"), nullable=False)
-    driver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    driver_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     odometer = Column(Integer, nullable=True)
     status = Column(String, default="OPEN")
@@ -103,7 +233,7 @@ class Report(Base):
 class Defect(Base):
     __tablename__ = "defects"
     id = Column(Integer, primary_key=True)
-    report_id = Column(Integer, ForeignKey("reports.id"), nullable=False)
+    report_id = Column(Integer, ForeignKey("reports.id"), nullable=False, index=True)
     component = Column(String, nullable=False)
     severity = Column(String, default="minor")
     description = Column(Text, nullable=True)
@@ -121,7 +251,7 @@ class Defect(Base):
 class Photo(Base):
     __tablename__ = "photos"
     id = Column(Integer, primary_key=True)
-    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=False)
+    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=False, index=True)
     path = Column(String, unique=True, nullable=False)
     caption = Column(String, nullable=True)
     defect = relationship("Defect", back_populates="photos")
@@ -129,18 +259,24 @@ class Photo(Base):
 class Note(Base):
     __tablename__ = "notes"
     id = Column(Integer, primary_key=True)
-    report_id = Column(Integer, ForeignKey("reports.id"), nullable=False)
+    report_id = Column(Integer, ForeignKey("reports.id"), nullable=False, index=True)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     text = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     report = relationship("Report", back_populates="notes")
     author = relationship("User")
     # ⬅️ NEW: link a note to a specific defect (optional)
-    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=True)
+    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=True, index=True)
     defect = relationship("Defect", back_populates="notes")
 
 class ServiceRecord(Base):
     __tablename__ = "service_records"
+    # covers truck_id lookups and pm_status_for's "latest odometer per type" seek
+    __table_args__ = (
+        Index("ix_svc_truck_type_odom", "truck_id", "service_type", "odometer"),
+        # list_service: newest first per truck
+        Index("ix_svc_truck_created", "truck_id", desc("created_at")),
+    )
     id = Column(Integer, primary_key=True)
     truck_id = Column(Integer, ForeignKey("trucks.id"), nullable=False)
     service_type = Column(String, nullable=False)  # 'oil' | 'chassis'
@@ -156,12 +292,21 @@ class Role(Base):
     name = Column(String(100), unique=True, index=True, nullable=False)
     permissions_json = Column(Text, nullable=False, default="[]")
 
+    # parsed list, keyed by the raw text it came from so direct writes to
+    # permissions_json are still picked up; not a mapped column
+    _perms_cache = None  # (raw, parsed)
+
     @property
     def permissions(self) -> List[str]:
-        try:
-            return json.loads(self.permissions_json or "[]")
-        except Exception:
-            return []
+        raw = self.permissions_json or "[]"
+        cached = self._perms_cache
+        if cached is None or cached[0] != raw:
+            try:
+                parsed = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                parsed = []
+            cached = self._perms_cache = (raw, parsed)
+        return list(cached[1])
 
     @permissions.setter
     def permissions(self, value: Optional[List[str]]):
@@ -170,6 +315,13 @@ class Role(Base):
 # ----------------- NEW: PM Appointment model -----------------
 class PMAppointment(Base):
     __tablename__ = "pm_appointments"
+    __table_args__ = (
+        # "earliest scheduled appt for this truck/type" (add_service, pm-with-appts);
+        # the truck_id prefix also covers list_pm_appointments?truck_id=
+        Index("ix_pmappt_truck_type_status_date", "truck_id", "service_type", "status", "scheduled_date"),
+        # list_pm_appointments?status= across the fleet, in date order
+        Index("ix_pmappt_status_date", "status", "scheduled_date"),
+    )
     id = Column(Integer, primary_key=True)
     truck_id = Column(Integer, ForeignKey("trucks.id"), nullable=False)
     service_type = Column(String, nullable=False)  # 'oil' | 'chassis'
@@ -179,51 +331,178 @@ class PMAppointment(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     truck = relationship("Truck")
 
-Base.metadata.create_all(bind=engine)
+@contextmanager
+def _init_lock():
+    if fcntl is None:  # non-POSIX dev box: single worker, no lock needed
+        yield
+        return
+    with open(INIT_LOCK_PATH, "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
 
-# --- Lightweight migration: ensure notes.defect_id exists (for existing DBs) ---
-if DB_URL.startswith("sqlite"):
-    try:
-        with engine.connect() as conn:
-            cols = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info('notes')")]
-            if 'defect_id' not in cols:
-                conn.exec_driver_sql("ALTER TABLE notes ADD COLUMN defect_id INTEGER REFERENCES defects(id)")
-    except Exception as e:
-        # Don't crash app startup if ALTER fails; you'll still see this in logs
-        print("SQLite lightweight migration warning:", e)
-else:
-    # For Postgres/MySQL you'd normally run a real migration (Alembic). Skipping here.
-    pass
+def init_db():
+    """Create tables, apply the lightweight migrations and add missing indexes.
+
+    Runs from the lifespan hook rather than at import. With several uvicorn
+    workers an exclusive file lock makes them take turns; everyone after the
+    first finds nothing left to do.
+    """
+    with _init_lock():
+        Base.metadata.create_all(bind=engine)
+
+        # --- Lightweight migration: ensure notes.defect_id and trucks.pm_version exist (for existing DBs) ---
+        if DB_URL.startswith("sqlite"):
+            try:
+                with engine.connect() as conn:
+                    cols = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info('notes')")]
+                    if 'defect_id' not in cols:
+                        conn.exec_driver_sql("ALTER TABLE notes ADD COLUMN defect_id INTEGER REFERENCES defects(id)")
+                    cols = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info('trucks')")]
+                    if 'pm_version' not in cols:
+                        conn.exec_driver_sql("ALTER TABLE trucks ADD COLUMN pm_version INTEGER NOT NULL DEFAULT 0")
+                    conn.commit()
+            except Exception as e:
+                # Don't crash app startup if ALTER fails; you'll still see this in logs
+                print("SQLite lightweight migration warning:", e)
+        else:
+            # For Postgres/MySQL you'd normally run a real migration (Alembic). The one
+            # exception is trucks.pm_version: every Truck select reads it, so an
+            # upgraded app can't run against an existing database without it.
+            try:
+                with engine.begin() as conn:
+                    if engine.dialect.name == "postgresql":
+                        # IF NOT EXISTS: safe when workers on several hosts start together
+                        conn.exec_driver_sql("ALTER TABLE trucks ADD COLUMN IF NOT EXISTS pm_version INTEGER NOT NULL DEFAULT 0")
+                    elif "pm_version" not in {c["name"] for c in inspect(conn).get_columns("trucks")}:
+                        conn.exec_driver_sql("ALTER TABLE trucks ADD COLUMN pm_version INTEGER NOT NULL DEFAULT 0")
+            except Exception as e:
+                print("Lightweight migration warning:", e)
+
+        # create_all() skips indexes on tables that already exist; add any missing ones
+        for table in Base.metadata.sorted_tables:
+            for ix in table.indexes:
+                try:
+                    ix.create(bind=engine, checkfirst=True)
+                except Exception as e:
+                    print("Index creation warning:", ix.name, e)
 # -------------------------------------------------------------------------------
 
 # ----------------- Auth helpers -----------------
 import jwt
-from passlib.hash import bcrypt
+from passlib.hash import bcrypt as bcrypt_scheme
+
+# Explicit work factor for new hashes. Existing hashes keep verifying with
+# whatever cost they were created with; needs_update() only flags ones below it.
+bcrypt = bcrypt_scheme.using(default_rounds=BCRYPT_ROUNDS, min_desired_rounds=BCRYPT_ROUNDS)
+
+def _b64url(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+# HS256 tokens always share the same header and key; encode them once.
+# Output is a standard JWT that jwt.decode() (decode_token) verifies as before.
+_JWT_KEY = JWT_SECRET.encode()
+_JWT_HEADER = _b64url(b'{"alg":"HS256","typ":"JWT"}')
 
 def make_token(user_id: int) -> str:
-    exp = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
-    # FIXED: removed stray closing bracket
-    return jwt.encode({"sub": str(user_id), "exp": exp}, JWT_SECRET, algorithm="HS256")
+    exp = int(time.time()) + JWT_EXPIRE_MINUTES * 60
+    payload = _b64url(json.dumps({"sub": str(user_id), "exp": exp}, separators=(",", ":")).encode())
+    signing_input = _JWT_HEADER + b"." + payload
+    sig = _b64url(hmac.new(_JWT_KEY, signing_input, hashlib.sha256).digest())
+    return (signing_input + b"." + sig).decode()
+
+class TTLCache:
+    """Small bounded LRU map whose entries also expire after `ttl` seconds.
+    Sync endpoints read and invalidate from the threadpool, hence the lock
+    (uncontended, it costs far less than the lookups it guards)."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            if hit[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return hit[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+# sha256(token) -> user id. Only tokens that passed signature verification are
+# stored, and never past their own exp; raw tokens are not kept in memory.
+_token_cache = TTLCache(TOKEN_CACHE_MAX, TOKEN_CACHE_TTL)
 
 def decode_token(token: str) -> int:
+    key = hashlib.sha256(token.encode()).digest()
+    uid = _token_cache.get(key)
+    if uid is not None:
+        return uid
     data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-    return int(data["sub"])
+    uid = int(data["sub"])
+    _token_cache.set(key, uid, min(TOKEN_CACHE_TTL, float(data["exp"]) - time.time()))
+    return uid
+
+# user id -> (name, email, role). Lets require_user skip the DB on most
+# requests. Staleness window: an edit made by another worker process can take
+# up to USER_CACHE_TTL seconds to show up here; users_patch/users_delete evict
+# their own process's entry immediately.
+_user_cache = TTLCache(int(os.getenv("DVCR_USER_CACHE_MAX", "5000")), USER_CACHE_TTL)
+
+def load_user(uid: int) -> Optional[User]:
+    fields = _user_cache.get(uid)
+    if fields is None:
+        # cache miss only: a short-lived session, so require_user itself needs none
+        with SessionLocal() as db:
+            row = db.get(User, uid)
+        if not row:
+            return None
+        fields = (row.name, row.email, row.role)
+        _user_cache.set(uid, fields)
+    # fresh transient User per request: handlers can't leak edits into the
+    # cache, and it is never attached to (or flushed by) their session
+    name, email, role = fields
+    return User(id=uid, name=name, email=email, role=role)
+
+def forget_user(uid: int) -> None:
+    _user_cache.pop(uid)
 
 def get_db():
+    # Full ORM session per request. Single-table reads with nothing to
+    # eager-load (list_trucks, get_truck) use engine.connect() directly instead.
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
-async def require_user(request: Request, db: Session = Depends(get_db)) -> User:
+async def require_user(request: Request) -> User:
     # Prefer JWT
-    auth = request.headers.get("authorization") or request.headers.get("Authorization")
-    if auth and auth.lower().startswith("bearer "):
-        token = auth.split(" ", 1)[1].strip()
+    # Starlette header lookup is already case-insensitive
+    auth = request.headers.get("authorization")
+    scheme, sep, token = auth.partition(" ") if auth else ("", "", "")
+    if sep and (scheme == "Bearer" or scheme.lower() == "bearer"):
+        token = token.strip()
         try:
             uid = decode_token(token)
-            user = db.get(User, uid)
+            user = load_user(uid)
             if user:
                 return user
         except Exception:
@@ -232,7 +511,7 @@ async def require_user(request: Request, db: Session = Depends(get_db)) -> User:
     # Back-compat demo header (kept for old frontend calls)
     user_id = request.headers.get("x-user-id")
     if user_id:
-        user = db.get(User, int(user_id))
+        user = load_user(int(user_id))
         if user:
             return user
 
@@ -245,14 +524,54 @@ def require_role(user: 'User', roles: List[str]):
     if user.role not in roles:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
 
+def _role_dep(roles: frozenset):
+    """Build a dependency that resolves the current user and 403s unless their
+    role is in `roles`. Admin is always included, as in require_role."""
+    allowed = roles | {"admin"}
+    async def dep(user: User = Depends(require_user)) -> User:
+        if user.role not in allowed:
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
+        return user
+    return dep
+
+require_admin = _role_dep(frozenset())
+require_manager = _role_dep(frozenset({"manager"}))
+require_mechanic = _role_dep(frozenset({"manager", "mechanic"}))  # mechanics plus managers
+
+# ----------------- Demo seed -----------------
+DEMO_USERS = [
+    ("Manager", "manager@example.com", "manager"),
+    ("Driver", "driver@example.com", "driver"),
+    ("Mechanic", "mechanic@example.com", "mechanic"),
+]
+
+def seed_demo():
+    """Create the demo logins shown on the login page, only if there are no users yet."""
+    db = SessionLocal()
+    try:
+        if db.query(db.query(User).exists()).scalar():
+            return
+        # bcrypt releases the GIL, so the per-user hashes can run side by side
+        with ThreadPoolExecutor(max_workers=len(DEMO_USERS)) as pool:
+            hashes = list(pool.map(bcrypt.hash, ["password123"] * len(DEMO_USERS)))
+        db.execute(insert(User), [
+            {"name": name, "email": email, "role": role, "password_hash": pw_hash}
+            for (name, email, role), pw_hash in zip(DEMO_USERS, hashes)
+        ])
+        db.commit()
+    except IntegrityError:
+        # another worker seeded first
+        db.rollback()
+    finally:
+        db.close()
+
 # ----------------- Schemas -----------------
 class UserOut(BaseModel):
     id: int
     name: str
     email: str
     role: str
-    class Config:
-        from_attributes = True  # pydantic v2
+    model_config = ConfigDict(from_attributes=True)
 
 class TruckIn(BaseModel):
     number: str
@@ -262,15 +581,13 @@ class TruckIn(BaseModel):
 class TruckOut(TruckIn):
     id: int
     odometer: int
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PhotoOut(BaseModel):
     id: int
     path: str
     caption: Optional[str]
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DefectIn(BaseModel):
     component: str
@@ -287,16 +604,14 @@ class UserLite(BaseModel):
     name: str
     email: str
     role: str
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class NoteOut(BaseModel):
     id: int
     author: UserLite
     text: str
     created_at: datetime
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DefectOut(DefectIn):
     id: int
@@ -306,8 +621,7 @@ class DefectOut(DefectIn):
     photos: List[PhotoOut] = []
     # ⬅️ NEW: per-issue notes in API output
     notes: List[NoteOut] = []
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ReportIn(BaseModel):
     odometer: Optional[int] = None
@@ -325,8 +639,10 @@ class ReportOut(BaseModel):
     type: str
     defects: List[DefectOut] = []
     notes: List[NoteOut] = []
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+# module-level so the list schema is built once, not per request
+REPORTS_TA = TypeAdapter(List[ReportOut])
 
 class LoginIn(BaseModel):
     email: str
@@ -376,8 +692,9 @@ class ServiceOut(BaseModel):
     odometer: int
     notes: Optional[str] = None
     created_at: datetime
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+SERVICES_TA = TypeAdapter(List[ServiceOut])
 
 # ----------------- NEW: Role schemas -----------------
 class RoleCreate(BaseModel):
@@ -388,8 +705,7 @@ class RoleOut(BaseModel):
     id: int
     name: str
     permissions: List[str]
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class RoleUpdate(BaseModel):
     name: Optional[str] = Field(default=None, max_length=100)
@@ -415,15 +731,80 @@ class PMAppointmentOut(BaseModel):
     scheduled_date: datetime
     status: str
     created_at: datetime
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+PM_APPTS_TA = TypeAdapter(List[PMAppointmentOut])
+
+# ----------------- Eager-load options -----------------
+# With DVCR_DEBUG_RAISELOAD=1, any relationship a query did not explicitly
+# eager-load raises on access instead of quietly issuing a lazy SELECT (N+1).
+DEFAULT_LOAD_OPTS = (raiseload("*"),) if DEBUG_RAISELOAD else ()
+
+# The columns UserOut serializes; users embedded in responses (drivers, note
+# authors, the users list) leave password_hash behind in the database.
+USER_OUT_COLS = (User.id, User.name, User.email, User.role)
+
+# Everything ReportOut serializes, loaded up front (IN/JOIN queries) instead of
+# one lazy SELECT per report/defect/note.
+REPORT_LOAD_OPTIONS = (
+    joinedload(Report.truck),
+    joinedload(Report.driver).load_only(*USER_OUT_COLS),
+    selectinload(Report.defects).selectinload(Defect.photos),
+    selectinload(Report.defects).selectinload(Defect.notes).joinedload(Note.author).load_only(*USER_OUT_COLS),
+    selectinload(Report.notes).joinedload(Note.author).load_only(*USER_OUT_COLS),
+) + DEFAULT_LOAD_OPTS
+
+def load_report(db: Session, report_id: int) -> Optional[Report]:
+    return db.execute(
+        select(Report).options(*REPORT_LOAD_OPTIONS).where(Report.id == report_id)
+    ).scalar_one_or_none()
+
+def json_list_response(adapter: TypeAdapter, items, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Validate ORM rows and encode them to JSON in one pass through a
+    module-level TypeAdapter. The route's response_model is then only used
+    for the OpenAPI schema."""
+    body = adapter.dump_json(adapter.validate_python(items, from_attributes=True))
+    return Response(body, media_type="application/json", headers=headers)
+
+def fetch_page(db: Session, stmt, skip: int, limit: int) -> Tuple[list, int]:
+    """Run `stmt` with OFFSET/LIMIT and return (entities, total matching rows).
+
+    The total rides along as COUNT(*) OVER () on every row, so one query
+    serves both the page and X-Total-Count. Only an empty page (past the
+    end, or limit=0) needs a separate COUNT.
+    """
+    rows = db.execute(stmt.add_columns(func.count().over()).offset(skip).limit(limit)).all()
+    if rows:
+        return [r[0] for r in rows], rows[0][1]
+    if not skip and limit > 0:
+        return [], 0  # an empty first page really means no matches
+    return [], db.scalar(select(func.count()).select_from(stmt.order_by(None).subquery()))
+
+def parse_cursor(raw: str) -> Tuple[datetime, int]:
+    """Split an X-Next-Cursor of the form "<iso timestamp>,<id>".
+
+    Timestamps aren't unique, so keyset pages compare (timestamp, id) as a
+    row value; the id tiebreak keeps rows that share the boundary timestamp.
+    """
+    when_s, _, id_s = raw.rpartition(",")
+    try:
+        return datetime.fromisoformat(when_s), int(id_s)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
 
 # ----------------- Routes -----------------
 @app.post("/auth/login", response_model=LoginOut)
 def login(payload: LoginIn, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not user.password_hash or not bcrypt.verify(payload.password, user.password_hash):
+    # sync on purpose: bcrypt and the commit below run on the threadpool, not the loop
+    user = db.execute(select(User).where(User.email == payload.email)).scalar_one_or_none()
+    if not user or not user.password_hash:
         raise HTTPException(401, "Invalid email or password")
+    if not bcrypt.verify(payload.password, user.password_hash):
+        raise HTTPException(401, "Invalid email or password")
+    # hashes made below BCRYPT_ROUNDS are upgraded once; stronger ones are kept
+    if bcrypt.needs_update(user.password_hash):
+        user.password_hash = bcrypt.hash(payload.password)
+        db.commit()
     token = make_token(user.id)
     return {"access_token": token, "user": user}
 
@@ -433,43 +814,37 @@ async def me(user: User = Depends(require_user)):
 
 # ----------------- NEW: Roles CRUD -----------------
 @app.get("/roles", response_model=List[RoleOut])
-def list_roles(user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["manager", "admin"])  # allow managers too (admins always pass)
+def list_roles(user: User = Depends(require_manager), db: Session = Depends(get_db)):
     roles = db.query(Role).order_by(Role.name.asc()).all()
     return [RoleOut(id=r.id, name=r.name, permissions=r.permissions) for r in roles]
 
 @app.post("/roles", response_model=RoleOut, status_code=201)
-def create_role(payload: RoleCreate, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["admin"])
-    if db.query(Role).filter(Role.name == payload.name).first():
+def create_role(payload: RoleCreate, user: User = Depends(require_admin), db: Session = Depends(get_db)):
+    if db.scalar(select(Role.id).where(Role.name == payload.name).limit(1)) is not None:
         raise HTTPException(status_code=400, detail="Role name already exists")
     r = Role(name=payload.name)
     r.permissions = payload.permissions
     db.add(r)
     db.commit()
-    db.refresh(r)
     return RoleOut(id=r.id, name=r.name, permissions=r.permissions)
 
 @app.patch("/roles/{role_id}", response_model=RoleOut)
-def update_role(role_id: int, payload: RoleUpdate, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["admin"])
+def update_role(role_id: int, payload: RoleUpdate, user: User = Depends(require_admin), db: Session = Depends(get_db)):
     r = db.query(Role).filter(Role.id == role_id).first()
     if not r:
         raise HTTPException(status_code=404, detail="Role not found")
     if payload.name is not None:
-        exists = db.query(Role).filter(Role.name == payload.name, Role.id != role_id).first()
-        if exists:
+        exists = db.scalar(select(Role.id).where(Role.name == payload.name, Role.id != role_id).limit(1))
+        if exists is not None:
             raise HTTPException(status_code=400, detail="Role name already exists")
         r.name = payload.name
     if payload.permissions is not None:
         r.permissions = payload.permissions
     db.commit()
-    db.refresh(r)
     return RoleOut(id=r.id, name=r.name, permissions=r.permissions)
 
 @app.delete("/roles/{role_id}", status_code=204)
-def delete_role(role_id: int, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["admin"])
+def delete_role(role_id: int, user: User = Depends(require_admin), db: Session = Depends(get_db)):
     r = db.query(Role).filter(Role.id == role_id).first()
     if not r:
         return Response(status_code=204)
@@ -479,92 +854,102 @@ def delete_role(role_id: int, user: User = Depends(require_user), db: Session =
 
 @app.get("/alerts/pm", response_model=List[PMAlert])
 def pm_alerts(
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    # managers/admins only
-    require_role(user, ["manager", "admin"])
-
-    results: List[PMAlert] = []
-    trucks = db.query(Truck).filter(Truck.active == True).all()
-
-    for t in trucks:
-        s = pm_status_for(t, db)
-        oil_soon = s["oil_miles_remaining"] <= PM_OIL_SOON_MILES
-        ch_soon = s["chassis_miles_remaining"] <= PM_CHASSIS_SOON_MILES
+    # plain (id, number, odometer) rows; alerts are built as dicts and encoded
+    # directly, since every value here is an int/str/bool we computed ourselves
+    trucks = db.execute(
+        select(Truck.id, Truck.number, Truck.odometer).where(Truck.active == True)
+    ).all()
+    last = last_service_odometers(db, [tid for tid, _, _ in trucks])
+
+    results = []
+    for tid, number, odometer in trucks:
+        odom, oil_next, oil_rem, ch_next, ch_rem = _pm_tuple(
+            odometer, last.get((tid, "oil")), last.get((tid, "chassis"))
+        )
+        oil_soon = oil_rem <= PM_OIL_SOON_MILES
+        ch_soon = ch_rem <= PM_CHASSIS_SOON_MILES
         if oil_soon or ch_soon:
-            results.append(PMAlert(
-                truck_id=t.id,
-                truck_number=t.number,
-                odometer=s["odometer"],
-                oil_next_due=s["oil_next_due"],
-                oil_miles_remaining=s["oil_miles_remaining"],
-                chassis_next_due=s["chassis_next_due"],
-                chassis_miles_remaining=s["chassis_miles_remaining"],
-                oil_due_soon=oil_soon,
-                chassis_due_soon=ch_soon,
-            ))
-    # sort by the most urgent (fewest miles remaining)
-    results.sort(key=lambda r: min(
-        r.oil_miles_remaining if r.oil_due_soon else 10**9,
-        r.chassis_miles_remaining if r.chassis_due_soon else 10**9
-    ))
-    return results
+            # sort key: the most urgent (fewest miles remaining) due-soon item
+            urgency = min(oil_rem if oil_soon else 10**9, ch_rem if ch_soon else 10**9)
+            results.append((urgency, {
+                "truck_id": tid,
+                "truck_number": number,
+                "odometer": odom,
+                "oil_next_due": oil_next,
+                "oil_miles_remaining": oil_rem,
+                "chassis_next_due": ch_next,
+                "chassis_miles_remaining": ch_rem,
+                "oil_due_soon": oil_soon,
+                "chassis_due_soon": ch_soon,
+            }))
+    results.sort(key=itemgetter(0))
+    # response_model stays for the OpenAPI schema
+    return ORJSONResponse([alert for _, alert in results])
 
 # ----------------- NEW: Alerts with appointments (non-breaking; extra endpoint) -----------------
 @app.get("/alerts/pm-with-appts")
 def pm_alerts_with_appts(
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
-    out = []
-    trucks = db.query(Truck).filter(Truck.active == True).all()
+    trucks = db.query(Truck).options(*DEFAULT_LOAD_OPTS).filter(Truck.active == True).all()
+    last = last_service_odometers(db, [t.id for t in trucks])
+    alerts = []
     for t in trucks:
-        s = pm_status_for(t, db)
-        oil_soon = s["oil_miles_remaining"] <= PM_OIL_SOON_MILES
-        ch_soon = s["chassis_miles_remaining"] <= PM_CHASSIS_SOON_MILES
-        if not (oil_soon or ch_soon):
-            continue
-
-        appt_oil = db.query(PMAppointment).filter(
-            PMAppointment.truck_id == t.id,
-            PMAppointment.service_type == "oil",
-            PMAppointment.status == "scheduled"
-        ).order_by(PMAppointment.scheduled_date.asc()).first()
-
-        appt_ch = db.query(PMAppointment).filter(
-            PMAppointment.truck_id == t.id,
-            PMAppointment.service_type == "chassis",
-            PMAppointment.status == "scheduled"
-        ).order_by(PMAppointment.scheduled_date.asc()).first()
+        odom, oil_next, oil_rem, ch_next, ch_rem = _pm_tuple(
+            t.odometer, last.get((t.id, "oil")), last.get((t.id, "chassis"))
+        )
+        oil_soon = oil_rem <= PM_OIL_SOON_MILES
+        ch_soon = ch_rem <= PM_CHASSIS_SOON_MILES
+        if oil_soon or ch_soon:
+            alerts.append((t, odom, oil_next, oil_rem, ch_next, ch_rem, oil_soon, ch_soon))
+
+    # earliest scheduled appointment per (truck, type), one query for all alerted trucks
+    appts: Dict[Tuple[int, str], PMAppointment] = {}
+    if alerts:
+        rows = db.query(PMAppointment).options(*DEFAULT_LOAD_OPTS).filter(
+            PMAppointment.truck_id.in_([a[0].id for a in alerts]),
+            PMAppointment.status == "scheduled",
+        ).order_by(PMAppointment.scheduled_date.asc(), PMAppointment.id.asc()).all()
+        for a in rows:
+            appts.setdefault((a.truck_id, a.service_type), a)
 
+    out = []
+    for t, odom, oil_next, oil_rem, ch_next, ch_rem, oil_soon, ch_soon in alerts:
+        appt_oil = appts.get((t.id, "oil"))
+        appt_ch = appts.get((t.id, "chassis"))
         out.append({
             "truck_id": t.id,
             "truck_number": t.number,
-            "odometer": s["odometer"],
-            "oil_next_due": s["oil_next_due"],
-            "oil_miles_remaining": s["oil_miles_remaining"],
-            "chassis_next_due": s["chassis_next_due"],
-            "chassis_miles_remaining": s["chassis_miles_remaining"],
+            "odometer": odom,
+            "oil_next_due": oil_next,
+            "oil_miles_remaining": oil_rem,
+            "chassis_next_due": ch_next,
+            "chassis_miles_remaining": ch_rem,
             "oil_due_soon": oil_soon,
             "chassis_due_soon": ch_soon,
             "oil_appt": ({
                 "id": appt_oil.id,
                 "shop": appt_oil.shop,
-                "scheduled_date": appt_oil.scheduled_date.isoformat(),
+                "scheduled_date": appt_oil.scheduled_date,
                 "status": appt_oil.status,
             } if appt_oil else None),
             "chassis_appt": ({
                 "id": appt_ch.id,
                 "shop": appt_ch.shop,
-                "scheduled_date": appt_ch.scheduled_date.isoformat(),
+                "scheduled_date": appt_ch.scheduled_date,
                 "status": appt_ch.status,
             } if appt_ch else None),
         })
     return out
 
 # ---- Users admin endpoints (search/pagination/sort + CRUD) ----
+# columns `sort` may name; anything else is a 400 rather than a getattr on User
+_USER_SORT = {"name": User.name, "email": User.email, "role": User.role, "id": User.id}
+
 @app.get("/users", response_model=List[UserOut])
 def users_list(
     response: Response,
@@ -573,30 +958,27 @@ def users_list(
     limit: int = 25,
     sort: str = "name",
     order: str = "asc",
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
-
-    query = db.query(User)
+    stmt = select(User)
     if q:
         like = f"%{q.strip()}%"
-        query = query.filter(or_(User.name.like(like), User.email.like(like), User.role.like(like)))
+        stmt = stmt.where(or_(User.name.like(like), User.email.like(like), User.role.like(like)))
 
-    total = query.count()
-
-    col = getattr(User, sort, User.name)
+    col = _USER_SORT.get(sort)
+    if col is None:
+        raise HTTPException(400, "Invalid sort column")
     if order.lower() == "desc":
         col = col.desc()
 
-    items = query.order_by(col).offset(skip).limit(limit).all()
+    items, total = fetch_page(db, stmt.options(load_only(*USER_OUT_COLS), *DEFAULT_LOAD_OPTS).order_by(col), skip, limit)
     response.headers["X-Total-Count"] = str(total)
     return items
 
 @app.post("/users", response_model=UserOut)
-def users_create(payload: UserCreate, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["manager", "admin"])
-    if db.query(User).filter(User.email == payload.email).first():
+def users_create(payload: UserCreate, user: User = Depends(require_manager), db: Session = Depends(get_db)):
+    if db.scalar(select(User.id).where(User.email == payload.email).limit(1)) is not None:
         raise HTTPException(400, "Email already exists")
     new_user = User(
         name=payload.name,
@@ -606,12 +988,10 @@ def users_create(payload: UserCreate, user: User = Depends(require_user), db: Se
     )
     db.add(new_user)
     db.commit()
-    db.refresh(new_user)
     return new_user
 
 @app.patch("/users/{uid}", response_model=UserOut)
-def users_patch(uid: int, payload: UserPatch, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["manager", "admin"])
+def users_patch(uid: int, payload: UserPatch, user: User = Depends(require_manager), db: Session = Depends(get_db)):
     u = db.get(User, uid)
     if not u:
         raise HTTPException(404, "User not found")
@@ -625,7 +1005,7 @@ def users_patch(uid: int, payload: UserPatch, user: User = Depends(require_user)
         raise HTTPException(400, "Admins cannot downgrade their own account")
 
     if payload.email and payload.email != u.email:
-        if db.query(User).filter(User.email == payload.email).first():
+        if db.scalar(select(User.id).where(User.email == payload.email).limit(1)) is not None:
             raise HTTPException(400, "Email already exists")
         u.email = payload.email
 
@@ -637,12 +1017,11 @@ def users_patch(uid: int, payload: UserPatch, user: User = Depends(require_user)
         u.password_hash = bcrypt.hash(payload.password)
 
     db.commit()
-    db.refresh(u)
+    forget_user(uid)
     return u
 
 @app.delete("/users/{uid}", status_code=204)
-def users_delete(uid: int, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["manager", "admin"])
+def users_delete(uid: int, user: User = Depends(require_manager), db: Session = Depends(get_db)):
     u = db.get(User, uid)
     if not u:
         return
@@ -653,21 +1032,30 @@ def users_delete(uid: int, user: User = Depends(require_user), db: Session = Dep
         raise HTTPException(400, "Refusing to delete your own account")
     db.delete(u)
     db.commit()
+    forget_user(uid)
 
 # ---- Trucks / Reports / Notes / Defects ----
 @app.get("/trucks", response_model=List[TruckOut])
-def list_trucks(db: Session = Depends(get_db)):
-    return db.query(Truck).order_by(Truck.number).all()
+def list_trucks(response: Response, skip: int = 0, limit: Optional[int] = None):
+    # plain Core rows (TruckOut reads them via from_attributes); no Session needed.
+    # Without skip/limit this is the whole fleet, which is what the frontend expects.
+    stmt = select(Truck.__table__).order_by(Truck.number)
+    with engine.connect() as conn:
+        if limit is None and not skip:
+            return conn.execute(stmt).all()
+        total = conn.scalar(select(func.count()).select_from(Truck.__table__))
+        response.headers["X-Total-Count"] = str(total)
+        return conn.execute(stmt.offset(skip).limit(limit)).all()
 
 @app.post("/trucks", response_model=TruckOut)
-def create_truck(payload: TruckIn, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    require_role(user, ["manager", "admin"])
-    t = Truck(number=payload.number, vin=payload.vin, active=payload.active)
-    db.add(t); db.commit(); db.refresh(t); return t
+def create_truck(payload: TruckIn, user: User = Depends(require_manager), db: Session = Depends(get_db)):
+    t = Truck(number=payload.number, vin=payload.vin, active=payload.active, odometer=0)
+    db.add(t); db.commit(); return t
 
 @app.get("/trucks/{truck_id}", response_model=TruckOut)
-def get_truck(truck_id: int, db: Session = Depends(get_db)):
-    t = db.get(Truck, truck_id)
+def get_truck(truck_id: int):
+    with engine.connect() as conn:
+        t = conn.execute(select(Truck.__table__).where(Truck.id == truck_id)).first()
     if not t: raise HTTPException(404, "Truck not found")
     return t
 
@@ -676,17 +1064,16 @@ def get_truck(truck_id: int, db: Session = Depends(get_db)):
 def patch_truck(
     truck_id: int,
     payload: TruckPatch,
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
     t = db.get(Truck, truck_id)
     if not t:
         raise HTTPException(404, "Truck not found")
 
     if payload.number is not None:
-        exists = db.query(Truck).filter(Truck.number == payload.number, Truck.id != truck_id).first()
-        if exists:
+        exists = db.scalar(select(Truck.id).where(Truck.number == payload.number, Truck.id != truck_id).limit(1))
+        if exists is not None:
             raise HTTPException(400, "Truck number already exists")
         t.number = payload.number
 
@@ -698,51 +1085,75 @@ def patch_truck(
         t.odometer = payload.odometer
 
     db.commit()
-    db.refresh(t)
     return t
 
 # Delete truck (cascades to reports/services/defects/notes/photos)
 @app.delete("/trucks/{truck_id}", status_code=204)
 def delete_truck(
     truck_id: int,
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
     t = db.get(Truck, truck_id)
     if not t:
         return
     db.delete(t)
     db.commit()
+    _pm_last_cache.pop((truck_id, t.pm_version))  # SQLite may hand the id out again
 
 # >>> reports list supports filter + pagination and returns X-Total-Count
+# Pass `before` (the X-Next-Cursor of the previous page) for keyset paging,
+# which walks ix_reports_truck_created instead of scanning past `skip` rows.
 @app.get("/trucks/{truck_id}/reports", response_model=List[ReportOut])
 def list_reports(
     truck_id: int,
-    response: Response,
     type: Optional[str] = None,  # 'pre' | 'post' (optional)
     skip: int = 0,
     limit: int = 50,
+    before: Optional[str] = None,  # X-Next-Cursor of the previous page: "<created_at>,<id>"
     db: Session = Depends(get_db),
 ):
-    q = db.query(Report).filter(Report.truck_id == truck_id).order_by(Report.created_at.desc())
+    filters = [Report.truck_id == truck_id]
     if type in ("pre", "post"):
-        q = q.filter(Report.type == type)
-
-    total = q.count()
-    items = q.offset(skip).limit(limit).all()
+        filters.append(Report.type == type)
+    stmt = select(Report).where(*filters).order_by(Report.created_at.desc(), Report.id.desc())
+
+    if before is not None:
+        # the window count would only see rows before the cursor; count the full
+        # set straight off the index rather than wrapping stmt in a subquery
+        total = db.scalar(select(func.count(Report.id)).where(*filters))
+        items = list(db.scalars(
+            stmt.where(tuple_(Report.created_at, Report.id) < parse_cursor(before))
+            .options(*REPORT_LOAD_OPTIONS).limit(limit)
+        ))
+    else:
+        items, total = fetch_page(db, stmt.options(*REPORT_LOAD_OPTIONS), skip, limit)
+
+    headers = {"X-Total-Count": str(total)}
+    if items and len(items) == limit:
+        headers["X-Next-Cursor"] = f"{items[-1].created_at.isoformat()},{items[-1].id}"
+    return json_list_response(REPORTS_TA, items, headers)
+
+def bump_odometer(db: Session, truck_id: int, odometer: int) -> None:
+    """Raise a truck's odometer to `odometer` if it is higher than the stored reading.
+
+    The comparison happens in the UPDATE's WHERE clause, so two concurrent
+    submissions can't overwrite a higher reading with a lower one. The
+    default synchronize_session keeps an already-loaded Truck in sync.
+    """
+    db.execute(
+        update(Truck)
+        .where(Truck.id == truck_id, or_(Truck.odometer.is_(None), Truck.odometer < odometer))
+        .values(odometer=odometer)
+    )
 
-    # eager-load nested collections
-    for r in items:
-        _ = r.defects, r.notes
-        for d in r.defects:
-            _ = d.photos
-            _ = d.notes
-            for n in d.notes:
-                _ = n.author
+def bump_pm_version(db: Session, truck_id: int) -> None:
+    """Mark a truck's service history as changed, in the caller's transaction.
 
-    response.headers["X-Total-Count"] = str(total)
-    return items
+    pm_status_for keys its cache on (truck id, pm_version), so every worker
+    stops using its old entry as soon as this commits.
+    """
+    db.execute(update(Truck).where(Truck.id == truck_id).values(pm_version=Truck.pm_version + 1))
 
 @app.post("/trucks/{truck_id}/reports", response_model=ReportOut)
 def create_report(truck_id: int, payload: ReportIn, user: User = Depends(require_user), db: Session = Depends(get_db)):
@@ -751,21 +1162,15 @@ def create_report(truck_id: int, payload: ReportIn, user: User = Depends(require
     r = Report(truck_id=truck_id, driver_id=user.id, odometer=payload.odometer, summary=payload.summary, type=payload.type)
     db.add(r)
     # update truck odometer if report has a higher reading
-    if payload.odometer and (truck.odometer is None or payload.odometer > truck.odometer):
-        truck.odometer = payload.odometer
-    db.commit(); db.refresh(r); return r
+    if payload.odometer:
+        bump_odometer(db, truck_id, payload.odometer)
+    db.commit()
+    return load_report(db, r.id)
 
 @app.get("/reports/{report_id}", response_model=ReportOut)
 def get_report(report_id: int, db: Session = Depends(get_db)):
-    r = db.get(Report, report_id)
+    r = load_report(db, report_id)
     if not r: raise HTTPException(404, "Report not found")
-    # eager-load collections
-    _ = r.defects, r.notes
-    for d in r.defects:
-        _ = d.photos
-        _ = d.notes
-        for n in d.notes:
-            _ = n.author
     return r
 
 # ReportPatch supports 'type'
@@ -796,27 +1201,41 @@ def patch_report(
         if payload.type not in ("pre", "post"):
             raise HTTPException(400, "type must be 'pre' or 'post'")
         r.type = payload.type
-    db.commit(); db.refresh(r); return r
+    db.commit()
+    return load_report(db, report_id)
 
 @app.delete("/reports/{report_id}", status_code=204)
 def delete_report(
     report_id: int,
-    user: User = Depends(require_user),
+    bg: BackgroundTasks,
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
-    r = db.get(Report, report_id)
-    if not r:
-        return
-    db.delete(r)
+    # Set-based deletes instead of the ORM cascade, which loads every defect,
+    # photo and note and deletes them row by row. Nothing here is in the
+    # session, so there is nothing to synchronize.
+    no_sync = {"synchronize_session": False}
+    defect_ids = select(Defect.id).where(Defect.report_id == report_id).scalar_subquery()
+    paths = db.scalars(
+        delete(Photo).where(Photo.defect_id.in_(defect_ids)).returning(Photo.path),
+        execution_options=no_sync,
+    ).all()
+    db.execute(
+        delete(Note).where(or_(Note.report_id == report_id, Note.defect_id.in_(defect_ids))),
+        execution_options=no_sync,
+    )
+    db.execute(delete(Defect).where(Defect.report_id == report_id), execution_options=no_sync)
+    db.execute(delete(Report).where(Report.id == report_id), execution_options=no_sync)
     db.commit()
+    # remove photo files from disk once the response is out
+    bg.add_task(_unlink_photo_files, paths)
 
 @app.post("/reports/{report_id}/notes", response_model=NoteOut)
 def add_note(report_id: int, note: NoteIn, user: User = Depends(require_user), db: Session = Depends(get_db)):
     r = db.get(Report, report_id)
     if not r: raise HTTPException(404, "Report not found")
     n = Note(report_id=report_id, author_id=user.id, text=note.text)
-    db.add(n); db.commit(); db.refresh(n); return n
+    db.add(n); db.commit(); return n
 
 class DefectPatch(BaseModel):
     description: Optional[str] = None
@@ -827,11 +1246,60 @@ def add_defect(report_id: int, d: DefectIn, user: User = Depends(require_user),
     r = db.get(Report, report_id)
     if not r: raise HTTPException(404, "Report not found")
     defect = Defect(report_id=report_id, component=d.component, severity=d.severity, description=d.description, x=d.x, y=d.y)
-    db.add(defect); db.commit(); db.refresh(defect); return defect
+    db.add(defect); db.commit(); return defect
+
+UPLOAD_CHUNK = 1024 * 1024  # 1 MiB; shutil's 16-64 KiB default means many tiny syscalls for photos
+
+def _copy_upload(src, out) -> None:
+    # Spooled uploads that already spilled to disk have a real fd: let the kernel
+    # copy it (zero-copy). SpooledTemporaryFile has no public "is on disk" flag
+    # and fileno() would force a rollover of in-memory uploads, so this peeks at
+    # CPython's private _rolled attribute. If it is ever renamed or missing,
+    # getattr's False default just means every upload takes the copyfileobj path.
+    if hasattr(os, "sendfile") and getattr(src, "_rolled", False):
+        try:
+            in_fd, out_fd = src.fileno(), out.fileno()
+            offset = src.tell()
+            remaining = os.fstat(in_fd).st_size - offset
+            while remaining > 0:
+                sent = os.sendfile(out_fd, in_fd, offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+            return
+        except OSError:
+            out.seek(0); out.truncate()
+    shutil.copyfileobj(src, out, UPLOAD_CHUNK)
+
+def _save_upload(f: UploadFile, out_path: str) -> None:
+    # blocking copy; write to a temp name and rename so a half-written file is never served
+    tmp_path = out_path + ".part"
+    with open(tmp_path, "wb") as out:
+        _copy_upload(f.file, out)
+    os.replace(tmp_path, out_path)
+
+def _store_uploads(owner_id: int, files: List[UploadFile]) -> List[str]:
+    """Write all uploads to UPLOAD_DIR and return their public /uploads/...
+    paths in the same order as `files`. Several files are copied side by side;
+    the copies are file I/O and release the GIL."""
+    names = []
+    for f in files:
+        ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+        names.append(f"{owner_id}_{ts}_{f.filename}")
+    out_paths = [os.path.join(UPLOAD_DIR, name) for name in names]
+    if len(files) == 1:
+        _save_upload(files[0], out_paths[0])
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(files), 8)) as pool:
+            list(pool.map(_save_upload, files, out_paths))
+    return [f"/uploads/{name}" for name in names]
 
 # Create a defect AND upload photos in one multipart request
+# sync like the other Session-backed handlers: the commits and file copies
+# run on the threadpool, not the event loop
 @app.post("/reports/{report_id}/defects-with-photos", response_model=DefectOut)
-async def add_defect_with_photos(
+def add_defect_with_photos(
     report_id: int,
     component: str = Form(...),
     severity: str = Form("minor"),
@@ -855,21 +1323,11 @@ async def add_defect_with_photos(
     )
     db.add(defect)
     db.commit()
-    db.refresh(defect)
 
-    saved: List[Photo] = []
     if files:
-        for f in files:
-            ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-            safe_name = f"{defect.id}_{ts}_{f.filename}"
-            out_path = os.path.join(UPLOAD_DIR, safe_name)
-            with open(out_path, "wb") as out:
-                shutil.copyfileobj(f.file, out)
-            p = Photo(defect_id=defect.id, path=f"/uploads/{safe_name}", caption=None)
-            db.add(p); saved.append(p)
+        paths = _store_uploads(defect.id, files)
+        db.execute(insert(Photo), [{"defect_id": defect.id, "path": path, "caption": None} for path in paths])
         db.commit()
-        for p in saved:
-            db.refresh(p)
 
     # Eager-load photos for response
     _ = defect.photos
@@ -885,23 +1343,20 @@ def patch_defect(defect_id: int, payload: DefectPatch, user: User = Depends(requ
         d.resolved = payload.resolved
         d.resolved_by_id = user.id if payload.resolved else None
         d.resolved_at = datetime.utcnow() if payload.resolved else None
-    db.commit(); db.refresh(d); return d
+    db.commit(); return d
 
 @app.post("/defects/{defect_id}/photos", response_model=List[PhotoOut])
-async def upload_photos(defect_id: int, files: List[UploadFile] = File(...), captions: Optional[str] = Form(None), user: User = Depends(require_user), db: Session = Depends(get_db)):
+def upload_photos(defect_id: int, files: List[UploadFile] = File(...), captions: Optional[str] = Form(None), user: User = Depends(require_user), db: Session = Depends(get_db)):
     d = db.get(Defect, defect_id)
     if not d: raise HTTPException(404, "Defect not found")
-    saved: List[Photo] = []
-    for f in files:
-        ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-        safe_name = f"{defect_id}_{ts}_{f.filename}"
-        out_path = os.path.join(UPLOAD_DIR, safe_name)
-        with open(out_path, "wb") as out: shutil.copyfileobj(f.file, out)
-        p = Photo(defect_id=defect_id, path=f"/uploads/{safe_name}", caption=captions)
-        db.add(p); saved.append(p)
+    paths = _store_uploads(defect_id, files)
+    # one multi-row INSERT; ids come back in the same order as `paths`
+    ids = db.execute(
+        insert(Photo).returning(Photo.id, sort_by_parameter_order=True),
+        [{"defect_id": defect_id, "path": path, "caption": captions} for path in paths],
+    ).scalars().all()
     db.commit()
-    for p in saved: db.refresh(p)
-    return saved
+    return [PhotoOut(id=pid, path=path, caption=captions) for pid, path in zip(ids, paths)]
 
 # ⬇️ NEW: list notes for a single defect
 @app.get("/defects/{defect_id}/notes", response_model=List[NoteOut])
@@ -909,10 +1364,12 @@ def list_defect_notes(defect_id: int, user: User = Depends(require_user), db: Se
     d = db.get(Defect, defect_id)
     if not d:
         raise HTTPException(404, "Defect not found")
-    notes = db.query(Note).filter(Note.defect_id == defect_id).order_by(Note.created_at.asc()).all()
-    for n in notes:
-        _ = n.author
-    return notes
+    return (
+        db.query(Note).options(joinedload(Note.author).load_only(*USER_OUT_COLS), *DEFAULT_LOAD_OPTS)
+        .filter(Note.defect_id == defect_id)
+        .order_by(Note.created_at.asc())
+        .all()
+    )
 
 # ⬇️ NEW: add a note to a single defect
 @app.post("/defects/{defect_id}/notes", response_model=NoteOut)
@@ -921,92 +1378,132 @@ def add_defect_note(defect_id: int, payload: NoteIn, user: User = Depends(requir
     if not d:
         raise HTTPException(404, "Defect not found")
     n = Note(report_id=d.report_id, author_id=user.id, text=payload.text, defect_id=defect_id)
-    db.add(n); db.commit(); db.refresh(n)
+    db.add(n); db.commit()
     _ = n.author
     return n
 
+def _safe_unlink(name: str, dir_fd: Optional[int] = None) -> None:
+    # one unlink instead of exists()+remove(), and no window between the two.
+    # Best effort: a missing, busy or unremovable file must not stop the rest.
+    try:
+        os.unlink(name, dir_fd=dir_fd)
+    except OSError:
+        pass
+
+def _unlink_photo_files(paths: List[str]) -> None:
+    """Best-effort removal of photo files; runs as a background task after the 204.
+
+    Paths are like "/uploads/filename.jpg" and the file lives at
+    UPLOAD_DIR/filename.jpg. Names are unlinked relative to one open
+    descriptor for UPLOAD_DIR, so the kernel doesn't re-walk the directory
+    path for every file.
+    """
+    names = [os.path.basename(p) for p in paths]
+    dir_fd = None
+    if os.unlink in os.supports_dir_fd:  # not on Windows
+        try:
+            dir_fd = os.open(UPLOAD_DIR, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+        except OSError:
+            pass  # fall back to full paths below
+    if dir_fd is None:
+        for name in names:
+            _safe_unlink(os.path.join(UPLOAD_DIR, name))
+        return
+    try:
+        for name in names:
+            _safe_unlink(name, dir_fd)
+    finally:
+        os.close(dir_fd)
+
 # DELETE a defect (and its photos)
 @app.delete("/defects/{defect_id}", status_code=204)
 def delete_defect(
     defect_id: int,
-    user: User = Depends(require_user),
+    bg: BackgroundTasks,
+    user: User = Depends(require_mechanic),
     db: Session = Depends(get_db),
 ):
-    # mechanics, managers, admins may delete
-    if user.role not in ["mechanic", "manager", "admin"]:
-        raise HTTPException(403, "Insufficient permissions")
     d = db.get(Defect, defect_id)
     if not d:
         return
 
-    # remove photo files from disk (best-effort)
-    for p in d.photos:
-        try:
-            # paths are like "/uploads/filename.jpg"
-            rel = p.path.lstrip("/")
-            if not os.path.isabs(rel):
-                rel = os.path.join(".", rel)
-            if os.path.exists(rel):
-                os.remove(rel)
-        except Exception:
-            pass
-
+    paths = [p.path for p in d.photos]
     db.delete(d)
     db.commit()
+    # remove photo files from disk once the response is out
+    bg.add_task(_unlink_photo_files, paths)
 
 # DELETE a single photo
 @app.delete("/photos/{photo_id}", status_code=204)
 def delete_photo(
     photo_id: int,
-    user: User = Depends(require_user),
+    bg: BackgroundTasks,
+    user: User = Depends(require_mechanic),
     db: Session = Depends(get_db),
 ):
-    if user.role not in ["mechanic", "manager", "admin"]:
-        raise HTTPException(403, "Insufficient permissions")
-    p = db.get(Photo, photo_id)
-    if not p:
+    # one DELETE ... RETURNING instead of get() + ORM delete
+    paths = db.scalars(
+        delete(Photo).where(Photo.id == photo_id).returning(Photo.path),
+        execution_options={"synchronize_session": False},
+    ).all()
+    if not paths:
         return
+    db.commit()
+    bg.add_task(_unlink_photo_files, paths)
 
-    # best-effort remove file
-    try:
-        rel = p.path.lstrip("/")
-        if not os.path.isabs(rel):
-            rel = os.path.join(".", rel)
-        if os.path.exists(rel):
-            os.remove(rel)
-    except Exception:
-        pass
+class PhotoIdsIn(BaseModel):
+    ids: List[int] = Field(..., max_length=500)
 
-    db.delete(p)
+# DELETE several photos in one statement (JSON body: {"ids": [...]})
+@app.delete("/photos", status_code=204)
+def delete_photos(
+    payload: PhotoIdsIn,
+    bg: BackgroundTasks,
+    user: User = Depends(require_mechanic),
+    db: Session = Depends(get_db),
+):
+    if not payload.ids:
+        return
+    paths = db.scalars(
+        delete(Photo).where(Photo.id.in_(payload.ids)).returning(Photo.path),
+        execution_options={"synchronize_session": False},
+    ).all()
     db.commit()
+    bg.add_task(_unlink_photo_files, paths)
 
 # ----------------- PM endpoints -----------------
-def pm_status_for(truck: Truck, db: Session) -> dict:
+def last_service_odometers(db: Session, truck_ids: List[int]) -> Dict[Tuple[int, str], int]:
+    """Highest serviced odometer per (truck_id, service_type), for any number of trucks in one query."""
+    if not truck_ids:
+        return {}
+    # lambda_stmt: the statement is built and cache-keyed once per call site;
+    # later calls only re-bind truck_ids (as an expanding IN parameter)
+    stmt = lambda_stmt(lambda: (
+        select(ServiceRecord.truck_id, ServiceRecord.service_type, func.max(ServiceRecord.odometer))
+        .where(ServiceRecord.truck_id.in_(truck_ids), ServiceRecord.service_type.in_(PM_TYPES))
+        .group_by(ServiceRecord.truck_id, ServiceRecord.service_type)
+    ))
+    rows = db.execute(stmt).all()
+    return {(tid, stype): odo for tid, stype, odo in rows}
+
+def _pm_tuple(odometer: Optional[int], last_oil: Optional[int], last_ch: Optional[int]) -> Tuple[int, int, int, int, int]:
     """
     Compute PM using STRICT interval-from-last-service logic:
       next_due = last_service_odometer + INTERVAL
     If there has never been a service and the truck's current odometer
     has already surpassed the first interval, round UP from the CURRENT
     ODO to the next interval multiple so the 'next due' is in the future.
-    """
-    odom = int(truck.odometer or 0)
-
-    last_oil = db.query(ServiceRecord).filter_by(
-        truck_id=truck.id, service_type="oil"
-    ).order_by(ServiceRecord.odometer.desc()).first()
-    last_ch = db.query(ServiceRecord).filter_by(
-        truck_id=truck.id, service_type="chassis"
-    ).order_by(ServiceRecord.odometer.desc()).first()
+    `last_oil` / `last_ch` are None when that service was never recorded.
 
-    last_oil_mi = int(last_oil.odometer) if last_oil else 0
-    last_ch_mi = int(last_ch.odometer) if last_ch else 0
-
-    OIL_INTERVAL = 20000
-    CHASSIS_INTERVAL = 10000
+    Returns (odometer, oil_next_due, oil_miles_remaining,
+    chassis_next_due, chassis_miles_remaining) as a plain tuple so the
+    fleet-wide alert loops don't build a dict per truck.
+    """
+    odom = int(odometer or 0)
 
     # Base = last service + interval
-    oil_next = last_oil_mi + OIL_INTERVAL
-    chassis_next = last_ch_mi + CHASSIS_INTERVAL
+    oil_next = (int(last_oil) if last_oil is not None else 0) + OIL_INTERVAL
+    chassis_next = (int(last_ch) if last_ch is not None else 0) + CHASSIS_INTERVAL
 
     # If no historical service and current odometer already beyond first interval,
     # anchor to the next future multiple of the interval based on CURRENT odometer
@@ -1015,56 +1512,130 @@ def pm_status_for(truck: Truck, db: Session) -> dict:
     if last_ch is None and odom > chassis_next:
         chassis_next = ((odom // CHASSIS_INTERVAL) + 1) * CHASSIS_INTERVAL
 
+    return (
+        odom,
+        oil_next, oil_next - odom if oil_next > odom else 0,
+        chassis_next, chassis_next - odom if chassis_next > odom else 0,
+    )
+
+def pm_status_from_last(odometer: Optional[int], last_oil: Optional[int], last_ch: Optional[int]) -> dict:
+    odom, oil_next, oil_rem, ch_next, ch_rem = _pm_tuple(odometer, last_oil, last_ch)
     return {
         "odometer": odom,
         "oil_next_due": oil_next,
-        "oil_miles_remaining": max(oil_next - odom, 0),
-        "chassis_next_due": chassis_next,
-        "chassis_miles_remaining": max(chassis_next - odom, 0),
+        "oil_miles_remaining": oil_rem,
+        "chassis_next_due": ch_next,
+        "chassis_miles_remaining": ch_rem,
     }
 
+# (truck_id, pm_version) -> (last oil odometer, last chassis odometer). Only
+# service history is cached; the current odometer always comes from the truck
+# row, so report submissions need no invalidation. Service writes bump
+# pm_version, which the already-loaded truck row carries, so a stale entry is
+# never hit again in any worker and a late set() can't resurrect old data.
+_pm_last_cache = TTLCache(PM_CACHE_MAX, PM_CACHE_TTL)
+
+def pm_status_for(truck: Truck, db: Session) -> dict:
+    key = (truck.id, truck.pm_version)
+    last = _pm_last_cache.get(key)
+    if last is None:
+        found = last_service_odometers(db, [truck.id])
+        last = (found.get((truck.id, "oil")), found.get((truck.id, "chassis")))
+        _pm_last_cache.set(key, last)
+    return pm_status_from_last(truck.odometer, *last)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check per RFC 9110 13.1.2: a "*" or comma-separated list,
+    compared weakly (W/ ignored), since proxies that compress often weaken tags."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
 @app.get("/trucks/{truck_id}/pm-next", response_model=PMStatus)
-def pm_next(truck_id: int, user: User = Depends(require_user), db: Session = Depends(get_db)):
+def pm_next(
+    truck_id: int,
+    request: Request,
+    response: Response,
+    user: User = Depends(require_user),
+    db: Session = Depends(get_db),
+):
     truck = db.get(Truck, truck_id)
     if not truck: raise HTTPException(404, "Truck not found")
+    # The status depends only on the odometer and the service history, and
+    # pm_version changes with every service write, so the truck row alone is an
+    # exact validator that never goes through the cache. Dashboards polling with
+    # If-None-Match get a bodiless 304 without the status being computed.
+    etag = f'"{truck.odometer or 0}-{truck.pm_version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}  # always revalidate
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return pm_status_for(truck, db)
 
 @app.post("/trucks/{truck_id}/service", response_model=PMStatus)
-def add_service(truck_id: int, svc: ServiceIn, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    if user.role not in ["manager", "mechanic", "admin"]:
-        raise HTTPException(403, "Insufficient permissions")
+def add_service(truck_id: int, svc: ServiceIn, user: User = Depends(require_mechanic), db: Session = Depends(get_db)):
     truck = db.get(Truck, truck_id)
     if not truck: raise HTTPException(404, "Truck not found")
     db.add(ServiceRecord(truck_id=truck_id, service_type=svc.service_type, odometer=svc.odometer, notes=svc.notes))
-    if svc.odometer and (truck.odometer is None or svc.odometer > truck.odometer):
-        truck.odometer = svc.odometer
-    db.commit()
+    if svc.odometer:
+        bump_odometer(db, truck_id, svc.odometer)
+    bump_pm_version(db, truck_id)
 
     # ----------------- NEW: mark earliest scheduled appt as completed for this service type -----------------
-    appt = db.query(PMAppointment).filter(
-        PMAppointment.truck_id == truck_id,
-        PMAppointment.service_type == svc.service_type,
-        PMAppointment.status == "scheduled"
-    ).order_by(PMAppointment.scheduled_date.asc()).first()
-    if appt:
-        appt.status = "completed"
-        db.commit()
+    # same transaction as the service record: one commit (one fsync) per call,
+    # and one UPDATE that picks the appointment via an index-ordered subquery
+    earliest = (
+        select(PMAppointment.id)
+        .where(
+            PMAppointment.truck_id == truck_id,
+            PMAppointment.service_type == svc.service_type,
+            PMAppointment.status == "scheduled",
+        )
+        .order_by(PMAppointment.scheduled_date.asc(), PMAppointment.id.asc())  # same pick as /alerts/pm-with-appts
+        .limit(1)
+        .scalar_subquery()
+    )
+    db.execute(update(PMAppointment).where(PMAppointment.id == earliest).values(status="completed"))
     # ---------------------------------------------------------------------------------------
+    db.commit()
 
     return pm_status_for(truck, db)
 
 @app.get("/trucks/{truck_id}/service", response_model=List[ServiceOut])
-def list_service(truck_id: int, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    return db.query(ServiceRecord).filter_by(truck_id=truck_id).order_by(ServiceRecord.created_at.desc()).all()
+def list_service(
+    truck_id: int,
+    skip: int = 0,
+    limit: Optional[int] = Query(None, le=500),  # unbounded by default (the CSV export reads it all)
+    before: Optional[str] = None,  # X-Next-Cursor of the previous page (keyset, like list_reports)
+    user: User = Depends(require_user),
+    db: Session = Depends(get_db),
+):
+    stmt = (
+        select(ServiceRecord).options(*DEFAULT_LOAD_OPTS)
+        .where(ServiceRecord.truck_id == truck_id)
+        .order_by(ServiceRecord.created_at.desc(), ServiceRecord.id.desc())
+    )
+    if before is not None:
+        stmt = stmt.where(tuple_(ServiceRecord.created_at, ServiceRecord.id) < parse_cursor(before))
+    else:
+        stmt = stmt.offset(skip)
+    rows = db.scalars(stmt.limit(limit)).all()
+    headers = {}
+    if limit and len(rows) == limit:
+        headers["X-Next-Cursor"] = f"{rows[-1].created_at.isoformat()},{rows[-1].id}"
+    return json_list_response(SERVICES_TA, rows, headers)
 
 @app.delete("/service/{service_id}", status_code=204)
-def delete_service(service_id: int, user: User = Depends(require_user), db: Session = Depends(get_db)):
-    if user.role not in ["manager", "mechanic", "admin"]:
-        raise HTTPException(403, "Insufficient permissions")
+def delete_service(service_id: int, user: User = Depends(require_mechanic), db: Session = Depends(get_db)):
     s = db.get(ServiceRecord, service_id)
     if not s:
         return
     db.delete(s)
+    bump_pm_version(db, s.truck_id)
     db.commit()
 
 # ----------------- NEW: PM Appointment CRUD -----------------
@@ -1072,25 +1643,37 @@ def delete_service(service_id: int, user: User = Depends(require_user), db: Sess
 def list_pm_appointments(
     truck_id: Optional[int] = None,
     status: Optional[str] = None,
-    user: User = Depends(require_user),
+    limit: Optional[int] = Query(None, le=500),  # omit for the full list (admin PM page)
+    after: Optional[str] = None,  # X-Next-Cursor of the previous page: "<scheduled_date>,<id>"
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
-    q = db.query(PMAppointment)
+    # PMAppointmentOut has no relationships, so nothing to eager-load; the
+    # debug raiseload keeps it that way
+    stmt = select(PMAppointment).options(*DEFAULT_LOAD_OPTS)
     if truck_id is not None:
-        q = q.filter(PMAppointment.truck_id == truck_id)
+        stmt = stmt.where(PMAppointment.truck_id == truck_id)
     if status:
-        q = q.filter(PMAppointment.status == status)
-    return q.order_by(PMAppointment.scheduled_date.asc()).all()
+        stmt = stmt.where(PMAppointment.status == status)
+    if after:
+        # many appointments share a date, so the cursor carries the id as a tiebreak
+        stmt = stmt.where(tuple_(PMAppointment.scheduled_date, PMAppointment.id) > parse_cursor(after))
+    stmt = stmt.order_by(PMAppointment.scheduled_date.asc(), PMAppointment.id.asc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    rows = db.scalars(stmt).all()
+    headers = {}
+    if limit is not None and rows and len(rows) == limit:
+        headers["X-Next-Cursor"] = f"{rows[-1].scheduled_date.isoformat()},{rows[-1].id}"
+    return json_list_response(PM_APPTS_TA, rows, headers)
 
 @app.post("/pm/appointments", response_model=PMAppointmentOut)
 def create_pm_appointment(
     payload: PMAppointmentIn,
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
-    if payload.service_type not in ("oil", "chassis"):
+    if payload.service_type not in PM_TYPES:
         raise HTTPException(400, "service_type must be 'oil' or 'chassis'")
     appt = PMAppointment(
         truck_id=payload.truck_id,
@@ -1098,17 +1681,16 @@ def create_pm_appointment(
         shop=payload.shop,
         scheduled_date=payload.scheduled_date,
     )
-    db.add(appt); db.commit(); db.refresh(appt)
+    db.add(appt); db.commit()
     return appt
 
 @app.patch("/pm/appointments/{appt_id}", response_model=PMAppointmentOut)
 def patch_pm_appointment(
     appt_id: int,
     payload: PMAppointmentPatch,
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
     appt = db.get(PMAppointment, appt_id)
     if not appt:
         raise HTTPException(404, "Appointment not found")
@@ -1120,16 +1702,15 @@ def patch_pm_appointment(
         if payload.status not in ("scheduled", "completed", "cancelled"):
             raise HTTPException(400, "Invalid status")
         appt.status = payload.status
-    db.commit(); db.refresh(appt)
+    db.commit()
     return appt
 
 @app.delete("/pm/appointments/{appt_id}", status_code=204)
 def delete_pm_appointment(
     appt_id: int,
-    user: User = Depends(require_user),
+    user: User = Depends(require_manager),
     db: Session = Depends(get_db),
 ):
-    require_role(user, ["manager", "admin"])
     appt = db.get(PMAppointment, appt_id)
     if not appt:
         return
@@ -1137,5 +1718,5 @@ def delete_pm_appointment(
 
 # ----------------- Health -----------------
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True}